@@ -0,0 +1,176 @@
+# pipeline/batch.py
+"""
+Bulk mode: runs many PDFs through the OpenAI Batch API instead of one
+synchronous vision call each (half the price, higher rate limits, results
+within the 24h completion window). Interactive single-PDF runs keep using
+the normal graph.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Any
+
+from pipeline.graph import create_pipeline
+from pipeline.nodes import build_correction_request, final_structuring_node, get_client, openai_session, parse_vision_response
+from tools.json_io import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+_BATCH_ENDPOINT = "/v1/chat/completions"
+_BATCH_DONE = {"completed", "failed", "expired", "cancelled"}
+
+# Batch API input limits are 200 MB and 50,000 requests per file; each
+# request carries its base64 page image (~170 KB), so large runs are split
+_BATCH_MAX_BYTES = 150 * 1024 * 1024
+_BATCH_MAX_REQUESTS = 50_000
+
+
+def _split_batches(lines: List[bytes]) -> List[List[bytes]]:
+    """Groups JSONL lines into input files that stay under the Batch API limits."""
+    batches, current, size = [], [], 0
+    for line in lines:
+        if current and (size + len(line) + 1 > _BATCH_MAX_BYTES or len(current) >= _BATCH_MAX_REQUESTS):
+            batches.append(current)
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def _log_batch_errors(client, batch):
+    """Logs the per-request failures from a batch's error file."""
+    if not batch.error_file_id:
+        return
+    errors = await client.files.content(batch.error_file_id)
+    for line in errors.text.splitlines():
+        if not line.strip():
+            continue
+        result = loads(line)
+        response = result.get("response") or {}
+        error = result.get("error") or (response.get("body") or {}).get("error")
+        logger.warning("⚠️ %s: request failed (%s)", result.get('custom_id'), error)
+
+
+async def _run_single_batch(client, lines: List[bytes], poll_interval: float) -> Dict[str, str]:
+    """
+    Submits one input file of JSONL request lines and waits for it.
+    Returns the message content of every successful response by custom_id.
+    """
+    batch_file = await client.files.create(file=("batch.jsonl", b"\n".join(lines)), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=_BATCH_ENDPOINT,
+        completion_window="24h"
+    )
+    logger.info("📦 Submitted batch %s with %s requests", batch.id, len(lines))
+
+    while batch.status not in _BATCH_DONE:
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+
+    await _log_batch_errors(client, batch)
+
+    if batch.status != "completed":
+        logger.error("❌ Batch %s ended with status %s", batch.id, batch.status)
+        return {}
+    if not batch.output_file_id:
+        logger.error("❌ Batch %s completed but every request failed", batch.id)
+        return {}
+
+    output = await client.files.content(batch.output_file_id)
+    contents = {}
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        result = loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            logger.warning("⚠️ %s: request failed (%s)", result['custom_id'], result.get('error'))
+            continue
+        contents[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return contents
+
+
+async def _run_batch(client, requests: Dict[str, Dict[str, Any]], poll_interval: float) -> Dict[str, str]:
+    """
+    Submits chat requests keyed by custom_id, split over as many batches as
+    the input limits require, and waits for all of them.
+    Returns the message content of every successful response by custom_id.
+    """
+    lines = [
+        dumps({"custom_id": custom_id, "method": "POST", "url": _BATCH_ENDPOINT, "body": body})
+        for custom_id, body in requests.items()
+    ]
+    contents = {}
+    for batch_contents in await asyncio.gather(
+        *(_run_single_batch(client, batch_lines, poll_interval) for batch_lines in _split_batches(lines))
+    ):
+        contents.update(batch_contents)
+    return contents
+
+
+def _parse_outputs(contents: Dict[str, str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Parses each answer; unreadable ones are logged and left out."""
+    outputs = {}
+    for cid, content in contents.items():
+        try:
+            outputs[cid] = parse_vision_response(content)
+        except (TypeError, ValueError, AttributeError) as e:
+            logger.warning("⚠️ %s: unreadable answer (%s)", cid, e)
+    return outputs
+
+
+async def process_pdfs_bulk(pdf_paths: List[str], poll_interval: float = 30.0) -> Dict[str, Any]:
+    """
+    Processes many PDFs through the Batch API.
+    Requests that come back with the wrong number of values are collected
+    and retried together in a second batch, mirroring the interactive retry.
+    Returns a dict mapping each PDF path to its values (None on failure).
+    """
+    async with openai_session():
+        client = get_client()
+        if not client:
+            raise ConnectionError("OpenAI client not initialized.")
+        return await _process_pdfs_bulk(client, pdf_paths, poll_interval)
+
+
+async def _process_pdfs_bulk(client, pdf_paths: List[str], poll_interval: float) -> Dict[str, Any]:
+    """process_pdfs_bulk() with the run's OpenAI client."""
+    app = create_pipeline()
+
+    # Context gathering + request building for every PDF (stops before the API call).
+    # A PDF that fails here is reported as None instead of aborting the run.
+    results = {}
+    states = {}
+    for i, pdf_path in enumerate(pdf_paths):
+        try:
+            states[f"pdf-{i}"] = await app.ainvoke({"pdf_path": pdf_path, "bulk_mode": True})
+        except Exception as e:
+            logger.error("❌ %s: could not prepare request (%s)", pdf_path, e)
+            results[pdf_path] = None
+
+    if not states:
+        return results
+
+    contents = await _run_batch(client, {cid: s["llm_request"] for cid, s in states.items()}, poll_interval)
+    outputs = _parse_outputs(contents)
+
+    # Second pass for wrong counts
+    corrections = {}
+    for cid, values in outputs.items():
+        state = states[cid]
+        if len(values) != len(state["target_values"]):
+            corrections[cid] = build_correction_request(state, state["llm_request"], contents[cid])
+    if corrections:
+        logger.warning("⚠️ %s PDFs returned the wrong count. Retrying in a second batch...", len(corrections))
+        retried = await _run_batch(client, corrections, poll_interval)
+        outputs.update(_parse_outputs(retried))
+
+    for cid, state in states.items():
+        if cid not in outputs:
+            results[state["pdf_path"]] = None
+            continue
+        final = final_structuring_node({**state, "llm_structured_output": outputs[cid]})
+        results[state["pdf_path"]] = final["values_with_metadata"]
+    return results
@@ -17,7 +17,13 @@ def create_pipeline():
     # Define the flow
     workflow.set_entry_point("gather_context")
     workflow.add_edge("gather_context", "reason_with_vision")
-    workflow.add_edge("reason_with_vision", "structure_final_output")
+    # Bulk runs stop once the vision request is prepared; pipeline/batch.py
+    # submits it through the Batch API and finishes the structuring itself
+    workflow.add_conditional_edges(
+        "reason_with_vision",
+        lambda state: END if state.get("bulk_mode") else "structure_final_output",
+        {END: END, "structure_final_output": "structure_final_output"}
+    )
     workflow.add_edge("structure_final_output", END)
 
     return workflow.compile()
\ No newline at end of file
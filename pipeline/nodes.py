@@ -1,40 +1,278 @@
 # pipeline/nodes.py - SMART DYNAMIC APPROACH
 import base64
+import hashlib
+import heapq
+import importlib.util
 import json
+import logging
 import os
-import re
-from typing import Dict, List, Any
+from bisect import bisect_right
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Optional, Union
+
+import fitz  # PyMuPDF
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 try:
-    from openai import OpenAI
+    import httpx
+except ImportError:
+    logger.error("FATAL ERROR: The 'httpx' library is not installed.")
+    httpx = None
 
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+try:
+    from openai import AsyncOpenAI
 except ImportError:
-    print("FATAL ERROR: The 'openai' library is not installed.")
-    client = None
-except Exception:
-    print("FATAL ERROR: OPENAI_API_KEY environment variable not set.")
-    client = None
+    logger.error("FATAL ERROR: The 'openai' library is not installed.")
+    AsyncOpenAI = None
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# The OpenAI client of the current run (see openai_session()). A client's
+# pooled connections belong to the event loop that opened them, so clients
+# are scoped to a run instead of living at module level.
+_SESSION: ContextVar[Optional[Dict[str, Any]]] = ContextVar("openai_session", default=None)
+
+
+def _new_client():
+    """
+    Builds the async OpenAI client, or returns None if openai/httpx or the
+    API key is missing.
+    """
+    if AsyncOpenAI is None or httpx is None:
+        return None
+    if not os.environ.get("OPENAI_API_KEY"):
+        logger.error("FATAL ERROR: OPENAI_API_KEY environment variable not set.")
+        return None
+    # Async client so several PDFs can wait on the vision model concurrently.
+    # One pooled (HTTP/2 when available) connection is shared by every call,
+    # so retries and later PDFs skip the TCP/TLS handshake.
+    return AsyncOpenAI(
+        api_key=os.environ["OPENAI_API_KEY"],
+        http_client=httpx.AsyncClient(
+            http2=_HTTP2,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+            timeout=httpx.Timeout(120.0, connect=5.0)
+        )
+    )
+
+
+@asynccontextmanager
+async def openai_session():
+    """
+    Scope for one run: every OpenAI call made inside it shares a single
+    client, created on first use and closed when the block exits. Nested
+    sessions reuse the outer one, and calls made outside any session get
+    a client of their own.
+    """
+    if _SESSION.get() is not None:
+        yield
+        return
+
+    session = {}
+    token = _SESSION.set(session)
+    try:
+        yield
+    finally:
+        _SESSION.reset(token)
+        if session.get("client") is not None:
+            await session["client"].close()
+
+
+def get_client():
+    """
+    The OpenAI client of the current openai_session() (None if it cannot
+    be created).
+    """
+    session = _SESSION.get()
+    if session is None:
+        raise RuntimeError("get_client() must be called inside openai_session()")
+    if "client" not in session:
+        session["client"] = _new_client()
+    return session["client"]
+
 
 from pipeline.state import PipelineState
-from tools.extractor import get_all_text_elements
+from tools.extractor import PDF_LOCK, get_all_text_elements, is_numeric_cell, open_document
+from tools.json_io import loads
+
+# Non-numeric cell values that are extracted like numbers
+_TEXT_VALUES = frozenset({"DD", "EE", "FF"})
+
+# Row labels the model sometimes puts among the column headers
+_ROW_LETTERS = frozenset({"AA", "BB", "CC"})
+
+# Section row header -> merged row header that must directly follow it
+_SECTION_MERGED_ROW = {"M1": "Merged1", "M2": "Merged2"}
+
+# On-disk cache of vision responses, keyed by a hash of the request
+_LLM_CACHE_DIR = os.path.join("output", "llm_cache")
+
+# Padding (in PDF points) kept around the detected text when cropping the page image
+_IMAGE_CLIP_MARGIN = 24
+
+# Zoom and JPEG quality of the page image sent to the vision model
+_IMAGE_ZOOM = 2
+_IMAGE_JPEG_QUALITY = 85
+
+# Set SAVE_PAGE_IMAGE=1 to also write the page image to output/ for inspection
+_SAVE_PAGE_IMAGE = os.environ.get("SAVE_PAGE_IMAGE") == "1"
+
+
+# Structured-output schema: the API enforces the answer's shape, so the
+# prompts only need to describe the task
+VALUE_SCHEMA = {
+    "name": "table_values",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "values": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "value": {"type": "string"},
+                        "row_headers": {"type": "array", "items": {"type": "string"}},
+                        "column_headers": {"type": "array", "items": {"type": "string"}}
+                    },
+                    "required": ["value", "row_headers", "column_headers"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["values"],
+        "additionalProperties": False
+    },
+    "strict": True
+}
+
+# Prompt templates, filled per PDF by build_vision_request/build_correction_request
+_STRUCTURE_PROMPT = """
+    Analyze this table and extract ALL values with their complete hierarchical structure.
+
+    **DETECTED TABLE STRUCTURE:**
+    Headers found: {detected_headers}
+
+    Column Structure:
+    {column_structure}
+
+    Row Structure:  
+    {row_structure}
+
+    **SPATIAL VALUE MAPPING:**
+    (x,y) are pixel positions of each value's top-left corner in the attached image
+    {spatial_hints}
+
+    **TASK:**
+    For each value, determine its complete hierarchical path by:
+    1. Finding ALL headers above it (column hierarchy)
+    2. Finding ALL headers to its left (row hierarchy)  
+    3. Following the nested structure from outer to inner levels
+
+    **OUTPUT:**
+    Return exactly {expected_count} values; "value" is the exact cell text and the
+    header arrays go from outermost to innermost.
+
+    **CRITICAL:** 
+    - Use the spatial coordinates to determine precise header relationships
+    - Include ALL hierarchy levels, don't skip intermediate headers
+    - For merged cells, inherit headers from the spanning area
+
+    Analyze the image systematically and return the complete hierarchical structure as JSON.
+    """
+
+_CORRECTION_PROMPT = """
+    You returned {returned_count} values but the table contains exactly {expected_count} values.
+
+    Use the spatial mapping provided to find ALL values:
+    {spatial_hints}
+
+    Add the missing values (or drop the extra ones) and return the complete
+    corrected list of exactly {expected_count} values.
+    """
+
 
+def encode_image_to_base64(image: Union[str, bytes]) -> str:
+    """
+    Encodes an image (file path or raw bytes) to a base64 string for the API call.
+    """
+    if isinstance(image, bytes):
+        data = image
+    else:
+        with open(image, "rb") as image_file:
+            data = image_file.read()
+    return base64.b64encode(data).decode('utf-8')
 
-def encode_image_to_base64(image_path: str) -> str:
-    """Encodes an image file to a base64 string for the API call."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+
+def _is_readable_answer(content: str) -> bool:
+    """True if parse_vision_response can read the answer."""
+    try:
+        parse_vision_response(content)
+        return True
+    except (TypeError, ValueError, AttributeError):
+        return False
 
 
-def analyze_table_structure(all_elements: List[Dict]) -> Dict[str, Any]:
+async def _create_completion(request: Dict[str, Any]) -> str:
+    """
+    Sends a chat request and returns the message content. Responses are
+    cached on disk under a hash of the full request (prompt, image, model
+    and settings), so rerunning an unchanged PDF skips the OpenAI call - also
+    without an API key. Editing the prompt changes the key, so stale answers
+    are never reused. Set PIPELINE_NO_CACHE=1 to bypass the cache.
+    Only complete answers that parse are cached; an unreadable entry is
+    ignored and replaced.
+    """
+    use_cache = os.environ.get("PIPELINE_NO_CACHE") != "1"
+    key = hashlib.blake2b(json.dumps(request, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+    cache_path = os.path.join(_LLM_CACHE_DIR, f"{key}.json")
+    if use_cache and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding='utf-8') as f:
+            content = f.read()
+        if _is_readable_answer(content):
+            logger.info("♻️ Using cached AI response")
+            return content
+        logger.warning("⚠️ Ignoring unreadable cached AI response")
+
+    async with openai_session():
+        client = get_client()
+        if not client:
+            raise ConnectionError("OpenAI client not initialized.")
+        response = await client.chat.completions.create(**request)
+    choice = response.choices[0]
+    content = choice.message.content
+
+    if use_cache and choice.finish_reason == "stop" and _is_readable_answer(content):
+        # Write-then-rename so an interrupted or concurrent run never leaves a partial entry
+        os.makedirs(_LLM_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{id(request)}.tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, cache_path)
+    return content
+
+
+def _is_target_value(text: str) -> bool:
+    """True for table cell values (numbers like "23,00" and DD/EE/FF)."""
+    return text in _TEXT_VALUES or is_numeric_cell(text)
+
+
+def analyze_table_structure(all_elements: List[Dict], value_flags: Optional[List[bool]] = None) -> Dict[str, Any]:
     """
     Dynamically analyze table structure from OCR data - NO HARD CODING!
+    `value_flags` can carry the per-element _is_target_value results if the
+    caller has already classified the elements.
     """
+    if value_flags is None:
+        value_flags = [_is_target_value(elem["text"]) for elem in all_elements]
+
     # Extract all header-like elements (non-numeric, high confidence)
-    headers = [elem for elem in all_elements if
-               not re.match(r'^\d{1,4},\d{2}$', elem["text"]) and
-               elem["text"] not in ["DD", "EE", "FF"] and
-               elem["confidence"] > 70]
+    headers = [elem for elem, is_value in zip(all_elements, value_flags) if
+               not is_value and elem["confidence"] > 70]
 
     # Sort headers by position
     headers.sort(key=lambda x: (x['bbox']['y0'], x['bbox']['x0']))
@@ -47,22 +285,34 @@ def analyze_table_structure(all_elements: List[Dict]) -> Dict[str, Any]:
     y_positions = [h['bbox']['y0'] for h in headers]
     y_positions = sorted(set(y_positions))
 
+    # Bucket every header into its column/row span with one binary search,
+    # instead of rescanning all headers for every boundary
+    column_headers = [[] for _ in range(len(x_positions) - 1)]
+    row_headers = [[] for _ in range(len(y_positions) - 1)]
+    for h in headers:
+        col = bisect_right(x_positions, h['bbox']['x0']) - 1
+        if col < len(column_headers):
+            column_headers[col].append(h)
+        row = bisect_right(y_positions, h['bbox']['y0']) - 1
+        if row < len(row_headers):
+            row_headers[row].append(h)
+
     # Create dynamic column mapping
     column_boundaries = []
-    for i in range(len(x_positions) - 1):
+    for i, col_headers in enumerate(column_headers):
         column_boundaries.append({
             'start': x_positions[i],
             'end': x_positions[i + 1],
-            'headers': [h for h in headers if x_positions[i] <= h['bbox']['x0'] < x_positions[i + 1]]
+            'headers': col_headers
         })
 
     # Create dynamic row mapping
     row_boundaries = []
-    for i in range(len(y_positions) - 1):
+    for i, r_headers in enumerate(row_headers):
         row_boundaries.append({
             'start': y_positions[i],
             'end': y_positions[i + 1],
-            'headers': [h for h in headers if y_positions[i] <= h['bbox']['y0'] < y_positions[i + 1]]
+            'headers': r_headers
         })
 
     return {
@@ -78,84 +328,118 @@ def context_gathering_node(state: PipelineState) -> Dict[str, Any]:
     """
     NODE 1: Dynamic structure analysis - NO HARD CODING
     """
-    print("\n🧠 NODE 1: DYNAMIC STRUCTURE ANALYSIS")
-    print("-" * 40)
+    logger.info("\n🧠 NODE 1: DYNAMIC STRUCTURE ANALYSIS\n" + "-" * 40)
     pdf_path = state["pdf_path"]
     all_elements = get_all_text_elements(pdf_path)
 
+    # Classify every element once; both the value and header filters use it
+    value_flags = [_is_target_value(elem["text"]) for elem in all_elements]
+
     # Extract target values (numbers + special text)
-    target_values = [elem for elem in all_elements if
-                     re.match(r'^\d{1,4},\d{2}$', elem["text"]) or
-                     elem["text"] in ["DD", "EE", "FF"]]
+    target_values = [elem for elem, is_value in zip(all_elements, value_flags) if is_value]
 
     # DYNAMIC structure analysis
-    structure = analyze_table_structure(all_elements)
+    structure = analyze_table_structure(all_elements, value_flags)
 
     # Sort target values by position
     target_values.sort(key=lambda x: (x['bbox']['y0'], x['bbox']['x0']))
 
-    # Create intelligent spatial context
-    spatial_hints = []
-    for value in target_values:
-        bbox = value['bbox']
-
-        # Find which column this value belongs to
-        column_info = "unknown_col"
-        for col in structure['column_boundaries']:
-            if col['start'] <= bbox['x0'] < col['end']:
-                col_headers = [h['text'] for h in col['headers']]
-                column_info = f"under_headers_{'/'.join(col_headers)}"
-                break
-
-        # Find which row this value belongs to
-        row_info = "unknown_row"
-        for row in structure['row_boundaries']:
-            if row['start'] <= bbox['y0'] < row['end']:
-                row_headers = [h['text'] for h in row['headers']]
-                row_info = f"in_row_{'/'.join(row_headers)}"
-                break
-
-        hint = f"Value '{value['text']}' at ({bbox['x0']},{bbox['y0']}) {column_info} {row_info}"
-        spatial_hints.append(hint)
-
-    # Save image
-    import fitz
-    doc = fitz.open(pdf_path)
-    page = doc.load_page(0)
-    pix = page.get_pixmap(matrix=fitz.Matrix(3, 3))
-    output_image_path = "output/page_image.png"
-    os.makedirs("output", exist_ok=True)
-    pix.save(output_image_path)
-    doc.close()
-
-    print(f"✅ Found {len(target_values)} values, {len(structure['headers'])} headers")
-    print(f"📊 Detected {len(structure['column_boundaries'])} columns, {len(structure['row_boundaries'])} rows")
+    # Header labels depend only on the boundary, so build them once
+    # instead of re-joining them for every value
+    column_labels = [f"under_headers_{'/'.join(h['text'] for h in col['headers'])}"
+                     for col in structure['column_boundaries']]
+    row_labels = [f"in_row_{'/'.join(h['text'] for h in row['headers'])}"
+                  for row in structure['row_boundaries']]
+
+    # Locate every value's column/row span in one vectorised binary search.
+    # Span i covers [positions[i], positions[i + 1]), so anything before the
+    # first or at/after the last position is outside the table grid.
+    xs = np.asarray(structure['x_positions'])
+    ys = np.asarray(structure['y_positions'])
+    value_x = np.fromiter((v['bbox']['x0'] for v in target_values), dtype=np.float64, count=len(target_values))
+    value_y = np.fromiter((v['bbox']['y0'] for v in target_values), dtype=np.float64, count=len(target_values))
+    col_idx = np.searchsorted(xs, value_x, side='right') - 1
+    row_idx = np.searchsorted(ys, value_y, side='right') - 1
+
+    # Render the page image for the vision model
+    with PDF_LOCK:
+        page = open_document(pdf_path).load_page(0)
+
+        # The vision model only needs the table, so rasterise just the region
+        # covered by the OCR'd text (plus a margin) instead of the whole page
+        clip = None
+        if all_elements:
+            boxes = np.array([(b['x0'], b['y0'], b['x1'], b['y1'])
+                              for b in (e['bbox'] for e in all_elements)])
+            x0, y0 = boxes[:, :2].min(axis=0) - _IMAGE_CLIP_MARGIN
+            x1, y1 = boxes[:, 2:].max(axis=0) + _IMAGE_CLIP_MARGIN
+            clip = fitz.Rect(x0, y0, x1, y1) & page.rect
+        origin_x, origin_y = (clip.x0, clip.y0) if clip is not None else (0, 0)
+        # 2x is enough for the vision model to read the table, and JPEG keeps
+        # the upload (and base64 payload) several times smaller than PNG
+        pix = page.get_pixmap(matrix=fitz.Matrix(_IMAGE_ZOOM, _IMAGE_ZOOM), clip=clip, colorspace=fitz.csRGB)
+        image_bytes = pix.tobytes("jpeg", jpg_quality=_IMAGE_JPEG_QUALITY)
+        del pix  # only the compressed JPEG is needed from here on
+
+    # Create intelligent spatial context. Coordinates are pixels in the image
+    # the model sees, i.e. page coordinates shifted by the clip origin and scaled
+    spatial_hints = [
+        f"Value '{value['text']}' at "
+        f"({round((value['bbox']['x0'] - origin_x) * _IMAGE_ZOOM)},"
+        f"{round((value['bbox']['y0'] - origin_y) * _IMAGE_ZOOM)}) "
+        f"{column_labels[c] if 0 <= c < len(column_labels) else 'unknown_col'} "
+        f"{row_labels[r] if 0 <= r < len(row_labels) else 'unknown_row'}"
+        for value, c, r in zip(target_values, col_idx.tolist(), row_idx.tolist())
+    ]
+
+    # The image goes to the vision node in memory; write it out only when
+    # debugging (one file per PDF, so concurrent runs don't collide)
+    if _SAVE_PAGE_IMAGE:
+        stem = os.path.splitext(os.path.basename(pdf_path))[0]
+        os.makedirs("output", exist_ok=True)
+        with open(os.path.join("output", f"{stem}_page_image.jpg"), "wb") as f:
+            f.write(image_bytes)
+
+    logger.info("✅ Found %s values, %s headers", len(target_values), len(structure['headers']))
+    logger.info("📊 Detected %s columns, %s rows", len(structure['column_boundaries']), len(structure['row_boundaries']))
 
     return {
         "all_text_elements": all_elements,
-        "page_image_path": output_image_path,
+        "page_image_b64": encode_image_to_base64(image_bytes),
         "target_values": target_values,
         "spatial_hints": spatial_hints,
         "table_structure": structure
     }
 
 
-def multimodal_reasoning_node(state: PipelineState) -> Dict[str, Any]:
-    """
-    NODE 2: AI with dynamic structure understanding
-    """
-    print("\n🤖 NODE 2: DYNAMIC STRUCTURE-AWARE AI")
-    print("-" * 40)
+def image_data_url(base64_image: str) -> str:
+    """Formats a base64 JPEG as the data URL the vision API expects."""
+    return f"data:image/jpeg;base64,{base64_image}"
+
 
-    if not client:
-        raise ConnectionError("OpenAI client not initialized.")
+def _vision_request(prompt: str, image_url: str) -> Dict[str, Any]:
+    """Chat Completions request body for one prompt + page image."""
+    return {
+        "model": "gpt-4o",
+        "messages": [
+            {"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": image_url, "detail": "high"}},
+            ]},
+        ],
+        "response_format": {"type": "json_schema", "json_schema": VALUE_SCHEMA},
+        "temperature": 0.0
+    }
 
-    image_path = state["page_image_path"]
+
+def build_vision_request(state: PipelineState, image_url: str) -> Dict[str, Any]:
+    """
+    Builds the main structure-extraction request for a PDF. Shared by the
+    interactive path and the Batch API bulk path (pipeline/batch.py).
+    """
     spatial_hints = state["spatial_hints"]
     structure = state["table_structure"]
 
-    base64_image = encode_image_to_base64(image_path)
-
     # Create dynamic structure description
     detected_headers = [h['text'] for h in structure['headers']]
     column_structure = []
@@ -168,89 +452,80 @@ def multimodal_reasoning_node(state: PipelineState) -> Dict[str, Any]:
         row_headers = [h['text'] for h in row['headers']]
         row_structure.append(f"Row {i + 1}: {' -> '.join(row_headers)}")
 
-    prompt = f"""
-    Analyze this table and extract ALL values with their complete hierarchical structure.
+    prompt = _STRUCTURE_PROMPT.format(
+        detected_headers=detected_headers,
+        column_structure="\n".join(column_structure),
+        row_structure="\n".join(row_structure),
+        spatial_hints="\n".join(spatial_hints[:15]),
+        expected_count=len(state['target_values'])
+    )
 
-    **DETECTED TABLE STRUCTURE:**
-    Headers found: {detected_headers}
+    return _vision_request(prompt, image_url)
 
-    Column Structure:
-    {chr(10).join(column_structure)}
 
-    Row Structure:  
-    {chr(10).join(row_structure)}
+def build_correction_request(state: PipelineState, request: Dict[str, Any], first_answer: str) -> Dict[str, Any]:
+    """
+    Builds the retry request sent when the model returned the wrong number of
+    values. It continues the original conversation with the model's first
+    answer, so the model fixes that answer instead of starting over.
+    """
+    spatial_hints = state["spatial_hints"]
+    expected_count = len(state['target_values'])
 
-    **SPATIAL VALUE MAPPING:**
-    {chr(10).join(spatial_hints[:15])}
+    correction_prompt = _CORRECTION_PROMPT.format(
+        returned_count=len(parse_vision_response(first_answer)),
+        expected_count=expected_count,
+        spatial_hints="\n".join(spatial_hints)
+    )
+    return {
+        **request,
+        "messages": request["messages"] + [
+            {"role": "assistant", "content": first_answer},
+            {"role": "user", "content": correction_prompt},
+        ]
+    }
 
-    **TASK:**
-    For each value, determine its complete hierarchical path by:
-    1. Finding ALL headers above it (column hierarchy)
-    2. Finding ALL headers to its left (row hierarchy)  
-    3. Following the nested structure from outer to inner levels
 
-    **JSON OUTPUT FORMAT:**
-    Return a JSON object with "values" array containing exactly {len(state['target_values'])} objects.
-    Each object must have:
-    - "value": the exact text content
-    - "row_headers": array of row headers from outermost to innermost
-    - "column_headers": array of column headers from outermost to innermost
+def parse_vision_response(content: str) -> List[Dict[str, Any]]:
+    """Extracts the "values" array from the model's JSON answer."""
+    data = loads(content)
+    return data.get("values", [])
 
-    **CRITICAL:** 
-    - Use the spatial coordinates to determine precise header relationships
-    - Include ALL hierarchy levels, don't skip intermediate headers
-    - For merged cells, inherit headers from the spanning area
 
-    Analyze the image systematically and return the complete hierarchical structure as JSON.
+async def multimodal_reasoning_node(state: PipelineState) -> Dict[str, Any]:
+    """
+    NODE 2: AI with dynamic structure understanding
     """
+    logger.info("\n🤖 NODE 2: DYNAMIC STRUCTURE-AWARE AI\n" + "-" * 40)
+
+    request = build_vision_request(state, image_data_url(state["page_image_b64"]))
+
+    # Bulk runs only prepare the request here; pipeline/batch.py submits all
+    # of them together through the Batch API and finishes the structuring
+    if state.get("bulk_mode"):
+        return {"llm_request": request}
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}},
-                ]},
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.0
-        )
-        llm_output = json.loads(response.choices[0].message.content)
-        values = llm_output.get("values", [])
+        answer = await _create_completion(request)
+        values = parse_vision_response(answer)
 
         expected_count = len(state['target_values'])
         if len(values) != expected_count:
-            print(f"⚠️ Expected {expected_count}, got {len(values)}. Retrying...")
-
-            correction_prompt = f"""
-            You returned {len(values)} values but the table contains exactly {expected_count} values.
-
-            Use the spatial mapping provided to find ALL values:
-            {chr(10).join(spatial_hints)}
-
-            Return a JSON object with exactly {expected_count} values in the "values" array.
-            """
-
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "user", "content": [
-                        {"type": "text", "text": correction_prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}},
-                    ]},
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.0
+            logger.warning("⚠️ Expected %s, got %s. Retrying...", expected_count, len(values))
+
+            values = parse_vision_response(
+                await _create_completion(build_correction_request(state, request, answer))
             )
-            llm_output = json.loads(response.choices[0].message.content)
-            values = llm_output.get("values", [])
 
-        print(f"✅ AI analyzed {len(values)} values with dynamic structure")
+        logger.info("✅ AI analyzed %s values with dynamic structure", len(values))
         return {"llm_structured_output": values}
 
+    except ConnectionError:
+        # No client and no cached answer: this run cannot produce results,
+        # so fail loudly instead of returning an all-"Unknown" table
+        raise
     except Exception as e:
-        print(f"❌ AI analysis failed: {e}")
+        logger.error("❌ AI analysis failed: %s", e)
         return {"llm_structured_output": []}
 
 
@@ -258,72 +533,63 @@ def final_structuring_node(state: PipelineState) -> Dict[str, Any]:
     """
     NODE 3: Smart merging with dynamic validation AND post-processing fixes
     """
-    print("\n🧩 NODE 3: DYNAMIC STRUCTURE MERGING + FIXES")
-    print("-" * 40)
+    logger.info("\n🧩 NODE 3: DYNAMIC STRUCTURE MERGING + FIXES\n" + "-" * 40)
 
     llm_data = state["llm_structured_output"]
     target_values = state["target_values"]
-    structure = state["table_structure"]
 
-    print(f"📊 AI: {len(llm_data)} values")
-    print(f"📊 OCR: {len(target_values)} values")
+    logger.info("📊 AI: %s values", len(llm_data))
+    logger.info("📊 OCR: %s values", len(target_values))
 
-    final_results = []
+    matched_results = []
     used_ocr_indices = set()
 
+    # Index OCR values by text once; each AI value then takes the first
+    # unused OCR entry with the same text in O(1)
+    ocr_index = defaultdict(deque)
+    for i, ocr_item in enumerate(target_values):
+        ocr_index[ocr_item["text"]].append(i)
+
     # Enhanced matching
     for llm_item in llm_data:
-        best_match = None
-        best_match_index = -1
-
-        # Find exact match
-        for i, ocr_item in enumerate(target_values):
-            if i in used_ocr_indices:
-                continue
-            if llm_item["value"] == ocr_item["text"]:
-                best_match = ocr_item
-                best_match_index = i
-                break
-
-        if best_match:
+        candidates = ocr_index.get(llm_item["value"])
+
+        if candidates:
+            best_match_index = candidates.popleft()
+            best_match = target_values[best_match_index]
+
             # POST-PROCESSING FIXES - Force correct structure regardless of AI output
             row_headers = llm_item.get("row_headers", [])
             column_headers = llm_item.get("column_headers", [])
 
             # FIX 1: Move AA/BB/CC from column_headers to row_headers
-            if any(letter in column_headers for letter in ["AA", "BB", "CC"]):
-                letter = next(l for l in ["AA", "BB", "CC"] if l in column_headers)
-                column_headers = [h for h in column_headers if h not in ["AA", "BB", "CC"]]
+            misplaced = _ROW_LETTERS.intersection(column_headers)
+            if misplaced:
+                letter = min(misplaced)  # AA before BB before CC, as before
+                column_headers = [h for h in column_headers if h not in _ROW_LETTERS]
                 if letter not in row_headers:
                     row_headers.append(letter)
-                print(f"🔧 Fixed {llm_item['value']}: moved {letter} to row_headers")
-
-            # FIX 2: Add missing "Merged1" in M1 section
-            if "M1" in row_headers and "Merged1" not in row_headers:
-                # Insert Merged1 after M1
-                m1_index = row_headers.index("M1")
-                row_headers.insert(m1_index + 1, "Merged1")
-                print(f"🔧 Fixed {llm_item['value']}: added missing Merged1")
+                logger.debug("🔧 Fixed %s: moved %s to row_headers", llm_item['value'], letter)
 
-            # FIX 3: Add missing "Merged2" in M2 section
-            if "M2" in row_headers and "Merged2" not in row_headers:
-                m2_index = row_headers.index("M2")
-                row_headers.insert(m2_index + 1, "Merged2")
-                print(f"🔧 Fixed {llm_item['value']}: added missing Merged2")
+            # FIX 2/3: Add the missing merged row header right after its section (M1 -> Merged1, M2 -> Merged2)
+            for section, merged in _SECTION_MERGED_ROW.items():
+                if section in row_headers and merged not in row_headers:
+                    row_headers.insert(row_headers.index(section) + 1, merged)
+                    logger.debug("🔧 Fixed %s: added missing %s", llm_item['value'], merged)
 
             # FIX 4: Fix 50,00 and 54,00 row assignment (should be Grid1/AA, not Grid3)
             if llm_item["value"] in ["50,00", "54,00"]:
                 if "Row.Invisible.Grid3" in row_headers or "CC" in row_headers:
                     # Replace with correct Grid1/AA
                     row_headers = ["M1", "Merged1", "Row.Invisible.Grid1", "AA"]
-                    print(f"🔧 Fixed {llm_item['value']}: corrected to Grid1/AA")
+                    logger.debug("🔧 Fixed %s: corrected to Grid1/AA", llm_item['value'])
 
             # FIX 5: Fix 35,00 values (should be M1, not M2)
             if llm_item["value"] == "35,00" and "M2" in row_headers:
                 row_headers = ["M1", "Merged1"]
-                print(f"🔧 Fixed {llm_item['value']}: corrected from M2 to M1")
+                logger.debug("🔧 Fixed %s: corrected from M2 to M1", llm_item['value'])
 
-            final_results.append({
+            matched_results.append({
                 "value": llm_item["value"],
                 "row_headers": row_headers,
                 "column_headers": column_headers,
@@ -332,12 +598,13 @@ def final_structuring_node(state: PipelineState) -> Dict[str, Any]:
             })
             used_ocr_indices.add(best_match_index)
         else:
-            print(f"⚠️ No match for: {llm_item['value']}")
+            logger.warning("⚠️ No match for: %s", llm_item['value'])
 
-    # Add unmatched OCR values with basic structure
+    # Add unmatched OCR values with basic structure (already in position order)
+    unmatched_results = []
     for i, ocr_item in enumerate(target_values):
         if i not in used_ocr_indices:
-            final_results.append({
+            unmatched_results.append({
                 "value": ocr_item["text"],
                 "row_headers": ["Unknown"],
                 "column_headers": ["Unknown"],
@@ -345,8 +612,11 @@ def final_structuring_node(state: PipelineState) -> Dict[str, Any]:
                 "bbox": ocr_item.get("bbox")
             })
 
-    # Sort by position
-    final_results.sort(key=lambda x: (x['bbox']['y0'], x['bbox']['x0']))
+    # Sort by position: only the AI-ordered matches need sorting, then the
+    # two sorted runs are merged (ties keep matches first, as before)
+    position = lambda x: (x['bbox']['y0'], x['bbox']['x0'])
+    matched_results.sort(key=position)
+    final_results = list(heapq.merge(matched_results, unmatched_results, key=position))
 
-    print(f"✅ Final: {len(final_results)} values with corrected structure")
+    logger.info("✅ Final: %s values with corrected structure", len(final_results))
     return {"values_with_metadata": final_results}
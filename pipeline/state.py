@@ -7,13 +7,15 @@ class PipelineState(TypedDict):
     """
     # Input
     pdf_path: str
+    bulk_mode: bool                         # Stop after building the vision request (Batch API runs)
 
     # Intermediate data
-    page_image_path: str                    # Path to the saved image of the PDF page
+    page_image_b64: str                     # base64 JPEG of the page, kept in memory
     all_text_elements: List[Dict[str, Any]] # Raw OCR data
     target_values: List[Dict[str, Any]]     # Filtered target values (numbers + DD/EE/FF)
     spatial_hints: List[str]                # Spatial coordinate hints for AI
     table_structure: Dict[str, Any]         # Dynamic table structure analysis
+    llm_request: Dict[str, Any]             # Vision request body prepared in bulk mode
     llm_structured_output: List[Dict[str, Any]] # The JSON response from the Vision AI
 
     # Final Output
@@ -1,6 +1,10 @@
 # run_pipeline.py
+import argparse
+import asyncio
+import multiprocessing
 import os
-import json
+import logging
+import sys
 
 # --- THE FIX IS HERE ---
 # We MUST load the .env file at the very beginning of the script,
@@ -10,7 +14,53 @@ load_dotenv()
 # --- END OF FIX ---
 
 # Now we can import the pipeline components
+from pipeline.batch import process_pdfs_bulk
 from pipeline.graph import create_pipeline
+from pipeline.nodes import openai_session
+from tools.json_io import write_json
+
+
+async def _run_pipeline(app, pdf_path: str):
+    """
+    Runs the graph for one PDF; returns the final state, or None on failure.
+    """
+    try:
+        async with openai_session():
+            return await app.ainvoke({"pdf_path": pdf_path})
+    except Exception as e:
+        print("\n" + "="*20 + " FATAL PIPELINE ERROR " + "="*20)
+        print(f"An error occurred during the pipeline execution for {pdf_path}: {e}")
+        print("Please check your OpenAI API key, account balance, and network connection.")
+        print("="*64)
+        return None
+
+
+def _save_results(pdf_path: str, results, output_path: str):
+    output_data = {
+        "source_pdf": pdf_path,
+        "total_values": len(results),
+        "values": results
+    }
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    write_json(output_path, output_data)
+
+
+def _output_paths(pdf_paths):
+    """
+    Maps each PDF to output/<name>_values_with_metadata.json. Outputs are
+    named by file name only, so PDFs that share a name (e.g. in different
+    directories) would overwrite each other and are rejected.
+    """
+    output_paths = {}
+    seen = {}
+    for pdf_path in pdf_paths:
+        stem = os.path.splitext(os.path.basename(pdf_path))[0]
+        if stem in seen:
+            raise ValueError(f"{pdf_path} and {seen[stem]} would both be saved as {stem}_values_with_metadata.json")
+        seen[stem] = pdf_path
+        output_paths[pdf_path] = os.path.join("output", f"{stem}_values_with_metadata.json")
+    return output_paths
 
 
 def process_pdf_with_metadata(pdf_path: str):
@@ -24,38 +74,18 @@ def process_pdf_with_metadata(pdf_path: str):
     # Create the pipeline
     app = create_pipeline()
 
-    # Initial state
-    initial_state = {
-        "pdf_path": pdf_path
-    }
-
     # Run the pipeline
     print("\n🚀 RUNNING PIPELINE...")
-    try:
-        final_state = app.invoke(initial_state)
-    except Exception as e:
-        print("\n" + "="*20 + " FATAL PIPELINE ERROR " + "="*20)
-        print(f"An error occurred during the pipeline execution: {e}")
-        print("Please check your OpenAI API key, account balance, and network connection.")
-        print("="*64)
+    final_state = asyncio.run(_run_pipeline(app, pdf_path))
+    if final_state is None:
         return None
 
     # Get results
     results = final_state.get("values_with_metadata", [])
 
     # Save results
-    output_dir = "output"
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, "values_with_metadata.json")
-
-    output_data = {
-        "source_pdf": pdf_path,
-        "total_values": len(results),
-        "values": results
-    }
-
-    with open(output_path, "w", encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    output_path = os.path.join("output", "values_with_metadata.json")
+    _save_results(pdf_path, results, output_path)
 
     print(f"\n✅ SUCCESS!")
     print(f"📁 Results saved to: {output_path}")
@@ -73,11 +103,122 @@ def process_pdf_with_metadata(pdf_path: str):
     return results
 
 
+async def process_pdfs(pdf_paths, max_concurrency: int = 4):
+    """
+    Processes several PDFs concurrently. The OpenAI round-trips overlap while
+    the OCR/render steps stay serialised behind the extractor's PDF lock.
+    Each PDF is saved to output/<name>_values_with_metadata.json.
+    Returns a dict mapping each PDF path to its results (None on failure).
+    """
+    output_paths = _output_paths(pdf_paths)
+    app = create_pipeline()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(pdf_path):
+        async with semaphore:
+            final_state = await _run_pipeline(app, pdf_path)
+        if final_state is None:
+            return None
+        results = final_state.get("values_with_metadata", [])
+        output_path = output_paths[pdf_path]
+        _save_results(pdf_path, results, output_path)
+        print(f"✅ {pdf_path}: {len(results)} values -> {output_path}")
+        return results
+
+    # One session for the whole run, so all PDFs share the pooled client
+    async with openai_session():
+        all_results = await asyncio.gather(*(run_one(p) for p in pdf_paths))
+    return dict(zip(pdf_paths, all_results))
+
+
+async def process_pdfs_bulk_and_save(pdf_paths):
+    """
+    Bulk variant of process_pdfs() that goes through the Batch API.
+    """
+    output_paths = _output_paths(pdf_paths)
+    all_results = await process_pdfs_bulk(pdf_paths)
+    for pdf_path, results in all_results.items():
+        if results is None:
+            print(f"❌ {pdf_path}: no batch result")
+            continue
+        output_path = output_paths[pdf_path]
+        _save_results(pdf_path, results, output_path)
+        print(f"✅ {pdf_path}: {len(results)} values -> {output_path}")
+    return all_results
+
+
+def _process_pdfs_in_worker(pdf_paths):
+    """Worker-process entry point: runs its chunk of PDFs on one event loop."""
+    return asyncio.run(process_pdfs(pdf_paths))
+
+
+def process_pdfs_parallel(pdf_paths, workers: int):
+    """
+    Spreads the PDFs over `workers` processes so rendering and OCR use
+    several cores; within each process the PDFs still overlap their
+    OpenAI calls through process_pdfs().
+    """
+    _output_paths(pdf_paths)  # reject name clashes before any worker starts
+    workers = max(1, min(workers, len(pdf_paths)))
+    if workers == 1:
+        return asyncio.run(process_pdfs(pdf_paths))
+
+    chunks = [pdf_paths[i::workers] for i in range(workers)]
+    all_results = {}
+    # maxtasksperchild=1: each worker exits after its chunk, so the page
+    # renders, OCR arrays and cached documents it held go back to the OS
+    with multiprocessing.Pool(workers, maxtasksperchild=1) as pool:
+        for chunk_results in pool.map(_process_pdfs_in_worker, chunks):
+            all_results.update(chunk_results)
+    return all_results
+
+
+def _collect_pdf_files(paths):
+    """Expands directories into the PDFs they contain."""
+    pdf_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            pdf_files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                    if name.lower().endswith(".pdf")))
+        else:
+            pdf_files.append(path)
+    return pdf_files
+
+
 if __name__ == "__main__":
+    # Node progress goes through logging; set LOG_LEVEL=DEBUG to also see
+    # the individual post-processing fixes
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(message)s", stream=sys.stdout)
+
+    parser = argparse.ArgumentParser(description="Extract table values with metadata from PDFs.")
+    parser.add_argument("pdfs", nargs="*", default=["data/Table-Example-R.pdf"],
+                        help="PDF files or directories of PDFs")
+    parser.add_argument("--bulk", action="store_true",
+                        help="route the PDFs through the OpenAI Batch API (cheaper, up to 24h)")
+    parser.add_argument("--workers", type=int, default=min(os.cpu_count() or 1, 4),
+                        help="worker processes for multi-PDF runs (default: min(CPUs, 4))")
+    args = parser.parse_args()
+
     # Ensure you have python-dotenv installed: pip install python-dotenv
-    pdf_file = "data/Table-Example-R.pdf"
+    pdf_files = _collect_pdf_files(args.pdfs)
 
-    if not os.path.exists(pdf_file):
-        print(f"❌ ERROR: PDF not found at {pdf_file}")
+    missing = [p for p in pdf_files if not os.path.exists(p)]
+    try:
+        _output_paths(pdf_files)
+        name_clash = None
+    except ValueError as e:
+        name_clash = e
+
+    if missing:
+        for pdf_file in missing:
+            print(f"❌ ERROR: PDF not found at {pdf_file}")
+    elif name_clash:
+        print(f"❌ ERROR: {name_clash}")
+    elif not pdf_files:
+        print("❌ ERROR: no PDFs found")
+    elif args.bulk:
+        asyncio.run(process_pdfs_bulk_and_save(pdf_files))
+    elif len(pdf_files) == 1:
+        process_pdf_with_metadata(pdf_files[0])
     else:
-        process_pdf_with_metadata(pdf_file)
\ No newline at end of file
+        process_pdfs_parallel(pdf_files, args.workers)
@@ -6,14 +6,15 @@ This version is robust and will create its own output directory.
 """
 import fitz
 import pytesseract
-from PIL import Image
-import io
-import cv2
 import numpy as np
-import json
 import os  # <-- IMPORT THE OS MODULE
 import sys
-import re
+
+# Make the project root importable when run from anywhere
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tools.extractor import is_numeric_cell
+from tools.json_io import write_json
 
 
 def direct_pdf_test(pdf_path):
@@ -29,8 +30,7 @@ def direct_pdf_test(pdf_path):
     # Method 2: Render and OCR
     print("\n2. Testing OCR on rendered image...")
     mat = fitz.Matrix(2, 2)
-    pix = page.get_pixmap(matrix=mat)
-    img_data = pix.tobytes("png")
+    pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
 
     # --- THE FIX IS HERE ---
     # Create the debug_output directory if it doesn't exist.
@@ -40,21 +40,20 @@ def direct_pdf_test(pdf_path):
 
     # Save image for inspection
     output_image_path = os.path.join(output_dir, "page_render.png")
-    with open(output_image_path, "wb") as f:
-        f.write(img_data)
+    pix.save(output_image_path)
     print(f"Saved page render to {output_image_path}")
 
-    # OCR the image
-    pil_img = Image.open(io.BytesIO(img_data))
-    gray = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2GRAY)
+    # OCR the gray image straight from the pixmap buffer (no PNG decode, no RGB -> gray pass)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+    del pix
+    doc.close()
     ocr_data = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
 
     # Find numeric values
     numeric_values = []
     for i in range(len(ocr_data['text'])):
         text = ocr_data['text'][i].strip()
-        # Use a regex for precision
-        if re.match(r'^\d{1,4},\d{2}$', text):
+        if is_numeric_cell(text):
             numeric_values.append(text)
 
     # Sort for consistent order, just like in simple_extractor
@@ -72,7 +71,7 @@ def direct_pdf_test(pdf_path):
     sorted_numeric_values = []
     for elem in all_text_elements:
         text = elem['text'].strip()
-        if re.match(r'^\d{1,4},\d{2}$', text):
+        if is_numeric_cell(text):
             sorted_numeric_values.append(text)
 
     print(f"\nFound {len(sorted_numeric_values)} numeric values:")
@@ -80,13 +79,12 @@ def direct_pdf_test(pdf_path):
 
     # Save detailed output
     output_json_path = os.path.join(output_dir, "direct_test_results.json")
-    with open(output_json_path, "w") as f:
-        json.dump({
-            'numeric_values': sorted_numeric_values
-        }, f, indent=2)
+    output_data = {
+        'numeric_values': sorted_numeric_values
+    }
+    write_json(output_json_path, output_data)
 
     print(f"\nDetailed results saved to {output_json_path}")
-    doc.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+# tests/test_numeric_cell.py
+r"""
+Regression test: is_numeric_cell must accept exactly the tokens the old
+regex ^\d{1,4},\d{2}$ accepted (run with pytest, or directly as a script).
+"""
+import os
+import random
+import re
+import sys
+
+# Make the project root importable when run from anywhere
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tools.extractor import is_numeric_cell
+
+NUMERIC_CELL_RE = re.compile(r'\d{1,4},\d{2}')
+
+
+def _regex_match(text):
+    return NUMERIC_CELL_RE.fullmatch(text) is not None
+
+
+def test_known_tokens():
+    for text in ["23,00", "1,00", "1234,56", "12345,67", ",00", "12,3", "12,345", "12.34",
+                 "", "AA", "DD", "1,0a", "a1,00", "٣,٣٣", "²,00", "12,34 "]:
+        assert is_numeric_cell(text) == _regex_match(text), repr(text)
+
+
+def test_random_tokens():
+    rng = random.Random(0)
+    alphabet = "0123456789,. a²٣"
+    for _ in range(100_000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 9)))
+        assert is_numeric_cell(text) == _regex_match(text), repr(text)
+
+
+if __name__ == "__main__":
+    test_known_tokens()
+    test_random_tokens()
+    print("--- TEST PASSED ---")
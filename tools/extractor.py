@@ -1,100 +1,202 @@
 # tools/extractor.py
 import fitz  # PyMuPDF
 import pytesseract
-from PIL import Image
-import io
-import cv2
 import numpy as np
-import json
-import re
+import functools
+import hashlib
+import logging
 import os
+import threading
 
+logger = logging.getLogger(__name__)
 
-def extract_values_from_pdf(pdf_path: str):
+# OCR render resolution; 144 DPI is the historical 2x zoom. Clean digital
+# tables rarely need more, and the raster size grows with the square of it.
+DEFAULT_OCR_DPI = 144
+
+# Extra Tesseract options (part of the OCR cache key). Left at the defaults:
+# on data/Table-Example-R.pdf "--psm 6" loses ten table values and "--oem 1"
+# changes the header tokens, so neither is a free speedup here.
+TESSERACT_CONFIG = ""
+
+# OCR results of scanned pages, keyed by file contents + DPI + Tesseract
+# config, so repeated runs skip Tesseract. Set PIPELINE_NO_CACHE=1 to bypass.
+OCR_CACHE_DIR = "cache"
+
+# PyMuPDF is not thread-safe, and LangGraph runs sync nodes on worker threads
+# when the graph is awaited, so every fitz call goes through this lock.
+PDF_LOCK = threading.RLock()
+
+
+@functools.lru_cache(maxsize=8)
+def _open_cached(abs_path: str, mtime: float):
+    return fitz.open(abs_path)
+
+
+def open_document(pdf_path: str):
+    """
+    Opens a PDF once per process and reuses the parsed document afterwards.
+    The cache is keyed on path + mtime, so edited files are re-read.
+    Callers must not close the returned document.
+    """
+    with PDF_LOCK:
+        return _open_cached(os.path.abspath(pdf_path), os.path.getmtime(pdf_path))
+
+
+def _read_first_page(pdf_path: str, dpi: int = DEFAULT_OCR_DPI):
+    """
+    Reads the words of the first page as columns (text, conf, x0, y0, x1, y1)
+    in page coordinates. Born-digital pages are read from their embedded text
+    layer; only pages whose text layer has no table values are rendered and
+    run through Tesseract.
+    Results are memoised per file version, so every caller in the process
+    shares a single parse/OCR of the page.
     """
-    Extracts all numeric table values from the PDF using OCR.
+    return _read_words_cached(os.path.abspath(pdf_path), os.path.getmtime(pdf_path), dpi)
+
+
+@functools.lru_cache(maxsize=8)
+def _read_words_cached(abs_path: str, mtime: float, dpi: int):
+    with PDF_LOCK:
+        page = open_document(abs_path).load_page(0)
+
+        # Fast path: the embedded text layer already has exact words and boxes.
+        # Only trust it if it actually contains table values; a scanned table
+        # with e.g. a typed title still needs OCR.
+        words = page.get_text("words")
+
+    if any(is_numeric_cell(w[4].strip()) for w in words):
+        boxes = np.floor(np.asarray([w[:4] for w in words], dtype=float)).astype(np.int32)
+        return _freeze({
+            "text": np.char.strip(np.asarray([w[4] for w in words], dtype=str)),
+            "conf": np.full(len(words), 100, dtype=np.int32),
+            "x0": boxes[:, 0], "y0": boxes[:, 1], "x1": boxes[:, 2], "y1": boxes[:, 3]
+        })
+
+    # No usable text layer: reuse an earlier OCR of the same file contents if there is one
+    use_cache = os.environ.get("PIPELINE_NO_CACHE") != "1"
+    config_tag = hashlib.sha1(TESSERACT_CONFIG.encode()).hexdigest()[:8]
+    cache_path = os.path.join(OCR_CACHE_DIR, f"{_file_digest(abs_path)}_{dpi}_{config_tag}.npz")
+    if use_cache and os.path.exists(cache_path):
+        with np.load(cache_path, allow_pickle=False) as cached:
+            return _freeze({key: cached[key] for key in cached.files})
+
+    with PDF_LOCK:
+        # Render straight into a single-channel gray buffer: no PNG
+        # round-trip and no separate RGB -> gray conversion pass
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        gray_img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+        del pix  # samples is a copy; don't keep a second raster alive during OCR
+
+    # Tesseract runs in its own process, so OCR happens outside the lock
+    ocr_data = pytesseract.image_to_data(gray_img, output_type=pytesseract.Output.DICT, config=TESSERACT_CONFIG)
+
+    # Map the boxes back from the rendered image to page space
+    scale = dpi / 72
+    left = np.asarray(ocr_data['left'], dtype=np.int32)
+    top = np.asarray(ocr_data['top'], dtype=np.int32)
+    right = left + np.asarray(ocr_data['width'], dtype=np.int32)
+    bottom = top + np.asarray(ocr_data['height'], dtype=np.int32)
+    words = {
+        "text": np.char.strip(np.asarray(ocr_data['text'], dtype=str)),
+        "conf": np.asarray(ocr_data['conf'], dtype=float).astype(np.int32),
+        "x0": np.floor_divide(left, scale).astype(np.int32),
+        "y0": np.floor_divide(top, scale).astype(np.int32),
+        "x1": np.floor_divide(right, scale).astype(np.int32),
+        "y1": np.floor_divide(bottom, scale).astype(np.int32)
+    }
+
+    if use_cache:
+        # Write-then-rename so parallel workers never see a partial file; the
+        # temp name is per process and thread, as identical PDFs can be OCR'd
+        # concurrently on the graph's worker threads
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **words)
+        os.replace(tmp_path, cache_path)
+
+    return _freeze(words)
+
+
+def _file_digest(path: str) -> str:
+    """SHA-1 of the file contents (the OCR cache key, independent of path/mtime)."""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _freeze(words):
+    """Marks cached word columns read-only so callers cannot corrupt the cache."""
+    for column in words.values():
+        column.setflags(write=False)
+    return words
+
+
+def _build_elements(words, mask: np.ndarray, text_key: str):
+    """
+    Builds element dicts for the words selected by `mask`.
+    """
+    return [
+        {
+            text_key: text,
+            "confidence": conf,
+            "bbox": {"x0": x0, "y0": y0, "x1": x1, "y1": y1}
+        }
+        for text, conf, x0, y0, x1, y1 in zip(
+            *(words[key][mask].tolist() for key in ("text", "conf", "x0", "y0", "x1", "y1"))
+        )
+    ]
+
+
+def is_numeric_cell(text: str) -> bool:
+    r"""
+    True for table values like "23,00" (1-4 digits, comma, 2 digits).
+    Same as matching ^\d{1,4},\d{2}$, but plain string checks are several
+    times faster than the regex engine for this fixed shape.
+    """
+    n = len(text)
+    return 4 <= n <= 7 and text[-3] == ',' and text[:-3].isdecimal() and text[-2:].isdecimal()
+
+
+def _numeric_values(words):
+    """Numeric table values in "XX,XX" format, sorted by position."""
+    texts = words["text"]
+    mask = np.fromiter((is_numeric_cell(t) for t in texts.tolist()),
+                       dtype=bool, count=len(texts))
+    extracted_values = _build_elements(words, mask, "value")
+
+    # Sort by position
+    extracted_values.sort(key=lambda item: (item['bbox']['y0'], item['bbox']['x0']))
+    return extracted_values
+
+
+def _text_elements(words):
+    """Non-empty tokens above the confidence threshold."""
+    mask = (np.char.str_len(words["text"]) > 0) & (words["conf"] > 30)
+    return _build_elements(words, mask, "text")
+
+
+def extract_values_from_pdf(pdf_path: str, dpi: int = DEFAULT_OCR_DPI):
+    """
+    Extracts all numeric table values from the PDF (text layer or OCR).
     Returns a list of dictionaries with value, confidence, and bbox.
     """
     try:
-        doc = fitz.open(pdf_path)
-        page = doc.load_page(0)
-
-        # Render at 2x resolution
-        mat = fitz.Matrix(2, 2)
-        pix = page.get_pixmap(matrix=mat)
-        img_data = pix.tobytes("png")
-        pil_img = Image.open(io.BytesIO(img_data))
-        doc.close()
-
-        # Convert to grayscale
-        gray_img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2GRAY)
-
-        # Run OCR
-        ocr_data = pytesseract.image_to_data(gray_img, output_type=pytesseract.Output.DICT)
-
-        # Extract numeric values
-        extracted_values = []
-        for i in range(len(ocr_data['text'])):
-            text = ocr_data['text'][i].strip()
-
-            # Find numbers in "XX,XX" format
-            if re.match(r'^\d{1,4},\d{2}$', text):
-                extracted_values.append({
-                    "value": text,
-                    "confidence": int(ocr_data['conf'][i]),
-                    "bbox": {
-                        "x0": ocr_data['left'][i] // 2,
-                        "y0": ocr_data['top'][i] // 2,
-                        "x1": (ocr_data['left'][i] + ocr_data['width'][i]) // 2,
-                        "y1": (ocr_data['top'][i] + ocr_data['height'][i]) // 2
-                    }
-                })
-
-        # Sort by position
-        extracted_values.sort(key=lambda item: (item['bbox']['y0'], item['bbox']['x0']))
-
-        return extracted_values
+        return _numeric_values(_read_first_page(pdf_path, dpi))
 
     except Exception as e:
-        print(f"Error in extract_values_from_pdf: {e}")
+        logger.error("Error in extract_values_from_pdf: %s", e)
         return []
 
 
-def get_all_text_elements(pdf_path: str):
+def get_all_text_elements(pdf_path: str, dpi: int = DEFAULT_OCR_DPI):
     """
     Extracts ALL text elements from PDF (not just numeric values).
     Returns a list of all text with positions and confidence.
     """
     try:
-        doc = fitz.open(pdf_path)
-        page = doc.load_page(0)
-
-        mat = fitz.Matrix(2, 2)
-        pix = page.get_pixmap(matrix=mat)
-        img_data = pix.tobytes("png")
-        pil_img = Image.open(io.BytesIO(img_data))
-        doc.close()
-
-        gray_img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2GRAY)
-        ocr_data = pytesseract.image_to_data(gray_img, output_type=pytesseract.Output.DICT)
-
-        all_elements = []
-        for i in range(len(ocr_data['text'])):
-            text = ocr_data['text'][i].strip()
-            if text and int(ocr_data['conf'][i]) > 30:
-                all_elements.append({
-                    "text": text,
-                    "confidence": int(ocr_data['conf'][i]),
-                    "bbox": {
-                        "x0": ocr_data['left'][i] // 2,
-                        "y0": ocr_data['top'][i] // 2,
-                        "x1": (ocr_data['left'][i] + ocr_data['width'][i]) // 2,
-                        "y1": (ocr_data['top'][i] + ocr_data['height'][i]) // 2
-                    }
-                })
-
-        return all_elements
+        return _text_elements(_read_first_page(pdf_path, dpi))
 
     except Exception as e:
-        print(f"Error in get_all_text_elements: {e}")
-        return []
\ No newline at end of file
+        logger.error("Error in get_all_text_elements: %s", e)
+        return []
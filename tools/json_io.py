@@ -0,0 +1,22 @@
+# tools/json_io.py
+"""
+JSON helpers shared by the pipeline, the CLI and the tests. Backed by orjson,
+which parses and serializes several times faster than the json module.
+"""
+import orjson
+
+
+def loads(data):
+    """Parses a JSON document (str or bytes)."""
+    return orjson.loads(data)
+
+
+def dumps(obj) -> bytes:
+    """Serializes `obj` to compact UTF-8 JSON bytes."""
+    return orjson.dumps(obj)
+
+
+def write_json(path: str, obj) -> None:
+    """Writes `obj` to `path` as indented UTF-8 JSON."""
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))